@@ -1,21 +1,39 @@
-from flask import Flask, request, jsonify
-from redis import Redis
-from rq import Queue
+from flask import Flask, request, jsonify, Response, stream_with_context
 import os
 import uuid
+import csv
+import io
+import json
 
-from db import init_db, create_account, create_domain, create_scan, get_scan, get_endpoint_details, get_scan_details, get_endpoint_with_alerts
-from tasks import discover_subdomains_and_endpoints
+from db import init_db, create_account, create_domain, create_scan, get_scan, get_endpoint_details, get_scan_details, get_endpoint_with_alerts, get_account_findings, iter_scan_export_rows, EXPORT_COLUMNS, create_domains_and_scans, create_schedule
+from jobs import enqueue_scan, enqueue_scans
 
 app = Flask(__name__)
 
-# Initialize DB (creates tables if needed)
-init_db()
+# Upper bound on domains accepted by one bulk scan request
+BULK_SCAN_LIMIT = int(os.getenv("BULK_SCAN_LIMIT", "5000"))
+# Shortest interval a recurring schedule may use; a scan can run for hours
+SCHEDULE_MIN_INTERVAL_SECONDS = int(os.getenv("SCHEDULE_MIN_INTERVAL_SECONDS", "3600"))
 
-# Configure Redis
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-redis_conn = Redis.from_url(REDIS_URL)
-q = Queue("default", connection=redis_conn)
+def parse_schedule(data):
+    """
+    Validate {"interval_seconds": ..., "window_seconds": ...} from a request body.
+    Returns the schedule dict, or raises ValueError with a message for the client.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("schedule must be an object with interval_seconds and window_seconds")
+    try:
+        interval_seconds = int(data.get("interval_seconds"))
+        window_seconds = int(data.get("window_seconds", 0))
+    except (TypeError, ValueError):
+        raise ValueError("interval_seconds and window_seconds must be integers")
+    if interval_seconds < SCHEDULE_MIN_INTERVAL_SECONDS:
+        raise ValueError(f"interval_seconds must be at least {SCHEDULE_MIN_INTERVAL_SECONDS}")
+    if window_seconds < 0:
+        raise ValueError("window_seconds must be non-negative")
+    if window_seconds > interval_seconds:
+        raise ValueError("window_seconds cannot be longer than interval_seconds")
+    return {"interval_seconds": interval_seconds, "window_seconds": window_seconds}
 
 @app.route("/account", methods=["POST"])
 def create_account_api():
@@ -45,9 +63,56 @@ def create_scan_api(account_uid, domain_uid):
     create_scan(account_uid, domain_uid, scan_uid)
 
     # Enqueue the combined subdomain, endpoint discovery, and ZAP scan job
-    job = q.enqueue(discover_subdomains_and_endpoints, scan_uid, domain_uid)
+    job = enqueue_scan(scan_uid, domain_uid)
     return jsonify({"scan_uid": scan_uid, "job_id": job.get_id()}), 201
 
+@app.route("/account/<account_uid>/scans/bulk", methods=["POST"])
+def create_bulk_scans_api(account_uid):
+    # body: {"domains": ["example.com", ...], "schedule": {"interval_seconds": ..., "window_seconds": ...}}
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "request body must be a JSON object"}), 400
+    domain_names = data.get("domains")
+    if not domain_names or not isinstance(domain_names, list) or not all(
+        isinstance(name, str) and name for name in domain_names
+    ):
+        return jsonify({"error": "domains must be a non-empty list of domain names"}), 400
+    if len(domain_names) > BULK_SCAN_LIMIT:
+        return jsonify({"error": f"at most {BULK_SCAN_LIMIT} domains per request"}), 400
+
+    schedule = None
+    if data.get("schedule") is not None:
+        try:
+            schedule = parse_schedule(data["schedule"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    try:
+        scans = create_domains_and_scans(account_uid, domain_names, schedule=schedule)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+    # One Redis round trip for every job. The scans are already committed;
+    # if this fails, recovery.py enqueues them once SCAN_QUEUED_GRACE_SECONDS pass
+    jobs = enqueue_scans(scans)
+    for scan, job in zip(scans, jobs):
+        scan["job_id"] = job.get_id()
+    return jsonify({"scans": scans}), 201
+
+@app.route("/account/<account_uid>/domain/<domain_uid>/schedule", methods=["POST"])
+def create_schedule_api(account_uid, domain_uid):
+    # body: {"interval_seconds": 604800, "window_seconds": 86400}
+    try:
+        schedule = parse_schedule(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        created = create_schedule(account_uid, domain_uid, **schedule)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify(created), 201
+
 
 @app.route("/account/<account_uid>/domain/<domain_uid>/scan/<scan_uid>", methods=["GET"])
 def get_scan_results_api(account_uid, domain_uid, scan_uid):
@@ -60,6 +125,45 @@ def get_scan_results_api(account_uid, domain_uid, scan_uid):
         return jsonify({"error": "Not found"}), 404
     return jsonify(details)
 
+@app.route("/account/<account_uid>/domain/<domain_uid>/scan/<scan_uid>/export", methods=["GET"])
+def export_scan_api(account_uid, domain_uid, scan_uid):
+    # format=ndjson (default) or csv; offset skips rows already received
+    export_format = request.args.get("format", "ndjson").lower()
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    try:
+        offset = int(request.args.get("offset", 0))
+        if offset < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "offset must be a non-negative integer"}), 400
+
+    if not get_scan(scan_uid):
+        return jsonify({"error": "Not found"}), 404
+
+    rows = iter_scan_export_rows(scan_uid, offset=offset)
+
+    if export_format == "csv":
+        def generate():
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS)
+            if offset == 0:
+                writer.writeheader()
+            for row in rows:
+                row = dict(row)
+                row["references_list"] = json.dumps(row["references_list"] or [])
+                writer.writerow(row)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate(0)
+            yield buf.getvalue()
+        return Response(stream_with_context(generate()), mimetype="text/csv")
+
+    def generate():
+        for row in rows:
+            yield json.dumps(row, default=str) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 @app.route("/account/<account_uid>/endpoint/<endpoint_uid>", methods=["GET"])
 def get_endpoint_details_api(account_uid, endpoint_uid):
     endpoint_data = get_endpoint_with_alerts(endpoint_uid)
@@ -67,6 +171,29 @@ def get_endpoint_details_api(account_uid, endpoint_uid):
         return jsonify({"error": "Not found"}), 404
     return jsonify(endpoint_data)
 
+@app.route("/account/<account_uid>/findings", methods=["GET"])
+def get_account_findings_api(account_uid):
+    # optional filters: severity (comma separated), alert_name, domain_uid, scan_uid, latest.
+    # By default only each domain's latest complete scan is counted;
+    # latest=false sums every scan, so recurring scans count once per run.
+    severity_param = request.args.get("severity", "")
+    severities = [s.strip() for s in severity_param.split(",") if s.strip()]
+    latest_only = (request.args.get("latest", "true").lower() != "false")
+
+    findings = get_account_findings(
+        account_uid,
+        severities=severities or None,
+        alert_name=request.args.get("alert_name"),
+        domain_uid=request.args.get("domain_uid"),
+        scan_uid=request.args.get("scan_uid"),
+        latest_only=latest_only,
+    )
+    if findings is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(findings)
+
 
 if __name__ == "__main__":
+    # Initialize DB (creates tables if needed); in production `python db.py` does this
+    init_db()
     app.run(host="0.0.0.0", port=10000, debug=True)
@@ -0,0 +1,57 @@
+# bench_startup.py
+"""
+Measure how long `app:app` takes to import and how much memory it holds,
+the way a fresh gunicorn web worker would boot it.
+
+    python bench_startup.py [--runs N] [--module app]
+
+Each run imports the module in a fresh interpreter and reports wall-clock
+import time and peak RSS. Pass --module tasks to compare with the worker side,
+or a comma-separated list (e.g. flask,redis,rq,tasks) to import several in order.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+for module in sys.argv[1].split(","):
+    __import__(module)
+elapsed = time.perf_counter() - start
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux
+maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rss_mb = maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+heavy = sorted(m for m in ("playwright", "bs4", "requests") if m in sys.modules)
+print(json.dumps({"import_ms": elapsed * 1000, "rss_mb": rss_mb, "heavy_modules": heavy}))
+"""
+
+def run_once(module):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, module],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--module", default="app")
+    args = parser.parse_args()
+
+    samples = [run_once(args.module) for _ in range(args.runs)]
+    import_ms = [s["import_ms"] for s in samples]
+    rss_mb = [s["rss_mb"] for s in samples]
+
+    print(f"module:        {args.module} ({args.runs} runs)")
+    print(f"import time:   median {statistics.median(import_ms):.1f} ms, "
+          f"min {min(import_ms):.1f} ms, max {max(import_ms):.1f} ms")
+    print(f"peak RSS:      median {statistics.median(rss_mb):.1f} MB")
+    print(f"heavy modules: {', '.join(samples[0]['heavy_modules']) or 'none'}")
+
+if __name__ == "__main__":
+    main()
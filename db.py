@@ -1,6 +1,6 @@
 import os
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import uuid
 import json
 
@@ -55,6 +55,58 @@ def init_db():
         );
     """)
 
+    # Heartbeat and retry bookkeeping used to recover scans from dead workers
+    cur.execute("""
+        ALTER TABLE scans
+            ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+    """)
+    # Unfinished scans per domain, checked before a schedule starts another
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS scans_domain_unfinished_idx
+            ON scans (domain_id) WHERE status IN ('queued', 'in_progress');
+    """)
+
+    # scan_checkpoints table: units of work a scan has already finished
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scan_checkpoints (
+            scan_id INTEGER NOT NULL REFERENCES scans(id) ON DELETE CASCADE,
+            stage VARCHAR(50) NOT NULL,
+            unit TEXT NOT NULL DEFAULT '',
+            completed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (scan_id, stage, unit)
+        );
+    """)
+
+    # scan_schedules table: recurring scans, started by scheduler.py
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scan_schedules (
+            id SERIAL PRIMARY KEY,
+            uid UUID NOT NULL DEFAULT gen_random_uuid(),
+            domain_id INTEGER NOT NULL REFERENCES domains(id) ON DELETE CASCADE,
+            interval_seconds INTEGER NOT NULL,
+            window_seconds INTEGER NOT NULL DEFAULT 0,
+            next_run_at TIMESTAMP NOT NULL,
+            last_run_at TIMESTAMP,
+            enabled BOOLEAN NOT NULL DEFAULT TRUE,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS scan_schedules_due_idx
+            ON scan_schedules (next_run_at) WHERE enabled;
+    """)
+    # One schedule per domain; drop duplicates created before the index existed
+    cur.execute("""
+        DELETE FROM scan_schedules a
+         USING scan_schedules b
+         WHERE a.domain_id = b.domain_id AND a.id > b.id;
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS scan_schedules_domain_idx
+            ON scan_schedules (domain_id);
+    """)
+
     # subdomains table
     cur.execute("""
         CREATE TABLE IF NOT EXISTS subdomains (
@@ -65,6 +117,16 @@ def init_db():
         );
     """)
 
+    # DNS resolution results for each subdomain (see dns_resolution.py)
+    cur.execute("""
+        ALTER TABLE subdomains
+            ADD COLUMN IF NOT EXISTS resolved BOOLEAN,
+            ADD COLUMN IF NOT EXISTS ips TEXT[] DEFAULT ARRAY[]::TEXT[],
+            ADD COLUMN IF NOT EXISTS cname VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS is_wildcard BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN IF NOT EXISTS crawl_host VARCHAR(255);
+    """)
+
     # endpoints table
     cur.execute("""
         CREATE TABLE IF NOT EXISTS endpoints (
@@ -106,6 +168,40 @@ def init_db():
         );
     """)
 
+    # finding_rollups table: per-scan alert counts, maintained by insert_alert
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS finding_rollups (
+            account_id INTEGER NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+            domain_id INTEGER NOT NULL REFERENCES domains(id) ON DELETE CASCADE,
+            scan_id INTEGER NOT NULL REFERENCES scans(id) ON DELETE CASCADE,
+            severity VARCHAR(50) NOT NULL,
+            alert_name VARCHAR(255) NOT NULL,
+            alert_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (account_id, domain_id, scan_id, severity, alert_name)
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS finding_rollups_account_severity_idx
+            ON finding_rollups (account_id, severity);
+    """)
+
+    # Backfill rollups for alerts that were stored before the table existed
+    cur.execute("SELECT 1 FROM finding_rollups LIMIT 1;")
+    if cur.fetchone() is None:
+        cur.execute("""
+            INSERT INTO finding_rollups (
+                account_id, domain_id, scan_id, severity, alert_name, alert_count
+            )
+            SELECT d.account_id, d.id, s.id,
+                   COALESCE(a.severity, 'Unknown'), a.name, COUNT(*)
+              FROM alerts a
+              JOIN endpoints e ON a.endpoint_id = e.id
+              JOIN scans s ON e.scan_id = s.id
+              JOIN domains d ON s.domain_id = d.id
+             GROUP BY d.account_id, d.id, s.id, COALESCE(a.severity, 'Unknown'), a.name;
+        """)
+
     conn.commit()
     cur.close()
     conn.close()
@@ -171,6 +267,165 @@ def create_scan(account_uid, domain_uid, scan_uid):
     cur.close()
     conn.close()
 
+def create_domains_and_scans(account_uid, domain_names, schedule=None):
+    """
+    Create a scan for every domain name in one transaction.
+    Domains the account already has (by name) are reused, the rest are created.
+    `schedule` is an optional {"interval_seconds": ..., "window_seconds": ...}
+    that also sets up (or replaces) the recurring scan for each domain.
+    Returns [{"domain_name": ..., "domain_uid": ..., "scan_uid": ...}, ...]
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+
+    # Get the account ID from the UID
+    cur.execute("SELECT id FROM accounts WHERE uid = %s;", (account_uid,))
+    account = cur.fetchone()
+    if not account:
+        cur.close()
+        conn.close()
+        raise ValueError("Account not found")
+
+    account_id = account[0]
+    domain_names = list(dict.fromkeys(domain_names))
+
+    cur.execute("""
+        SELECT DISTINCT ON (domain_name) domain_name, id, uid
+          FROM domains
+         WHERE account_id = %s AND domain_name = ANY(%s)
+         ORDER BY domain_name, id;
+    """, (account_id, domain_names))
+    domains = {name: (domain_id, str(uid)) for name, domain_id, uid in cur.fetchall()}
+
+    missing = [name for name in domain_names if name not in domains]
+    if missing:
+        created = execute_values(cur, """
+            INSERT INTO domains (account_id, uid, domain_name) VALUES %s
+            RETURNING domain_name, id, uid;
+        """, [(account_id, str(uuid.uuid4()), name) for name in missing],
+            page_size=len(missing), fetch=True)
+        domains.update({name: (domain_id, str(uid)) for name, domain_id, uid in created})
+
+    scans = [
+        {"domain_name": name, "domain_uid": domains[name][1], "scan_uid": str(uuid.uuid4())}
+        for name in domain_names
+    ]
+    execute_values(cur, """
+        INSERT INTO scans (domain_id, uid) VALUES %s;
+    """, [(domains[s["domain_name"]][0], s["scan_uid"]) for s in scans],
+        page_size=len(scans))
+
+    if schedule:
+        # The next run is one interval away, spread randomly over the window
+        execute_values(cur, """
+            INSERT INTO scan_schedules (domain_id, interval_seconds, window_seconds, next_run_at)
+            SELECT v.domain_id, v.interval_seconds, v.window_seconds,
+                   NOW() + make_interval(secs => v.interval_seconds + random() * v.window_seconds)
+              FROM (VALUES %s) AS v(domain_id, interval_seconds, window_seconds)
+            ON CONFLICT (domain_id) DO UPDATE
+            SET interval_seconds = EXCLUDED.interval_seconds,
+                window_seconds = EXCLUDED.window_seconds,
+                next_run_at = EXCLUDED.next_run_at,
+                enabled = TRUE;
+        """, [
+            (domains[name][0], schedule["interval_seconds"], schedule["window_seconds"])
+            for name in domain_names
+        ], page_size=len(domain_names))
+
+    conn.commit()
+    cur.close()
+    conn.close()
+    return scans
+
+def create_schedule(account_uid, domain_uid, interval_seconds, window_seconds=0):
+    """
+    Create or replace the recurring scan for a domain in the 'scan_schedules' table.
+    The first run lands at a random point in the next `window_seconds`, so
+    schedules created together do not all fire at once.
+    Returns {"schedule_uid": ..., "next_run_at": ...}.
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    # Get the domain ID from the UID
+    cur.execute("""
+        SELECT d.id FROM domains d
+        JOIN accounts a ON d.account_id = a.id
+        WHERE a.uid = %s AND d.uid = %s;
+    """, (account_uid, domain_uid))
+    domain = cur.fetchone()
+    if not domain:
+        cur.close()
+        conn.close()
+        raise ValueError("Domain not found")
+
+    cur.execute("""
+        INSERT INTO scan_schedules (domain_id, interval_seconds, window_seconds, next_run_at)
+        VALUES (%s, %s, %s, NOW() + make_interval(secs => random() * %s))
+        ON CONFLICT (domain_id) DO UPDATE
+        SET interval_seconds = EXCLUDED.interval_seconds,
+            window_seconds = EXCLUDED.window_seconds,
+            next_run_at = EXCLUDED.next_run_at,
+            enabled = TRUE
+        RETURNING uid AS schedule_uid, next_run_at;
+    """, (domain["id"], interval_seconds, window_seconds, window_seconds))
+    schedule = cur.fetchone()
+    conn.commit()
+    cur.close()
+    conn.close()
+    return schedule
+
+def claim_due_schedules(limit):
+    """
+    Create a scan for up to `limit` due schedules and move each schedule's
+    next_run_at forward by whole intervals, keeping its jittered offset.
+    A schedule whose domain still has a queued or running scan stays due
+    and starts on the first call after that scan finishes.
+    Safe to run from several schedulers at once (SKIP LOCKED).
+    Returns [{"scan_uid": ..., "domain_uid": ...}, ...]
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT sc.id, sc.domain_id, d.uid AS domain_uid
+          FROM scan_schedules sc
+          JOIN domains d ON sc.domain_id = d.id
+         WHERE sc.enabled AND sc.next_run_at <= NOW()
+           AND NOT EXISTS (
+               SELECT 1 FROM scans s
+                WHERE s.domain_id = sc.domain_id
+                  AND s.status IN ('queued', 'in_progress')
+           )
+         ORDER BY sc.next_run_at
+         LIMIT %s
+           FOR UPDATE OF sc SKIP LOCKED;
+    """, (limit,))
+    due = cur.fetchall()
+    if not due:
+        conn.commit()
+        cur.close()
+        conn.close()
+        return []
+
+    scans = [{"scan_uid": str(uuid.uuid4()), "domain_uid": str(r["domain_uid"])} for r in due]
+    execute_values(cur, """
+        INSERT INTO scans (domain_id, uid) VALUES %s;
+    """, [(r["domain_id"], s["scan_uid"]) for r, s in zip(due, scans)], page_size=len(due))
+
+    # Runs missed while the scheduler was down are skipped, not replayed
+    cur.execute("""
+        UPDATE scan_schedules
+           SET last_run_at = NOW(),
+               next_run_at = next_run_at + make_interval(secs => interval_seconds * GREATEST(1, CEIL(
+                   EXTRACT(EPOCH FROM NOW() - next_run_at) / interval_seconds
+               )))
+         WHERE id = ANY(%s);
+    """, ([r["id"] for r in due],))
+    conn.commit()
+    cur.close()
+    conn.close()
+    return scans
+
 def get_scan(scan_uid):
     """
     Retrieve a scan by its UID.
@@ -201,15 +456,201 @@ def get_endpoint_details(endpoint_uid):
     conn.close()
     return endpoint
 
-def update_scan_status(scan_uid, status):
+def update_scan_status(scan_uid, status, attempts=None):
     """
     Update the status of a scan by its UID.
+    With `attempts`, only an 'in_progress' run of that attempt is updated,
+    so a worker whose scan was handed to another cannot overwrite it.
+    Returns whether the scan was updated.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    if attempts is None:
+        cur.execute("""
+            UPDATE scans SET status = %s, heartbeat_at = NOW() WHERE uid = %s;
+        """, (status, scan_uid))
+    else:
+        cur.execute("""
+            UPDATE scans SET status = %s, heartbeat_at = NOW()
+             WHERE uid = %s AND status = 'in_progress' AND attempts = %s;
+        """, (status, scan_uid, attempts))
+    updated = cur.rowcount > 0
+    conn.commit()
+    cur.close()
+    conn.close()
+    return updated
+
+def start_scan(scan_uid):
+    """
+    Move a 'queued' scan to 'in_progress' for the worker that picked it up.
+    Returns {"id": ..., "attempts": ...}, or None if the scan is not queued
+    (already running elsewhere, finished, or unknown). `attempts` identifies
+    this run for touch_scan_heartbeat and update_scan_status.
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        UPDATE scans SET status = 'in_progress', heartbeat_at = NOW()
+         WHERE uid = %s AND status = 'queued'
+        RETURNING id, attempts;
+    """, (scan_uid,))
+    scan = cur.fetchone()
+    conn.commit()
+    cur.close()
+    conn.close()
+    return scan
+
+def touch_scan_heartbeat(scan_uid, attempts):
+    """
+    Record that the worker running this attempt of the scan is still making
+    progress. Returns False once claim_stale_scans has requeued the scan
+    (bumping `attempts`), meaning this worker has been superseded.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE scans SET heartbeat_at = NOW()
+         WHERE uid = %s AND status = 'in_progress' AND attempts = %s;
+    """, (scan_uid, attempts))
+    updated = cur.rowcount > 0
+    conn.commit()
+    cur.close()
+    conn.close()
+    return updated
+
+def claim_stale_scans(stale_seconds, max_attempts):
+    """
+    Find 'in_progress' scans whose heartbeat is older than `stale_seconds`.
+    Scans that have been retried `max_attempts` times are marked 'error';
+    the rest are flipped back to 'queued' and returned so they can be requeued:
+      [{"scan_uid": ..., "domain_uid": ...}, ...]
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        UPDATE scans
+           SET status = 'error'
+         WHERE status = 'in_progress'
+           AND COALESCE(heartbeat_at, created_at) < NOW() - make_interval(secs => %s)
+           AND attempts >= %s;
+    """, (stale_seconds, max_attempts))
+    cur.execute("""
+        UPDATE scans s
+           SET status = 'queued', attempts = s.attempts + 1, heartbeat_at = NOW()
+          FROM domains d
+         WHERE s.domain_id = d.id
+           AND s.status = 'in_progress'
+           AND COALESCE(s.heartbeat_at, s.created_at) < NOW() - make_interval(secs => %s)
+           AND s.attempts < %s
+        RETURNING s.uid AS scan_uid, d.uid AS domain_uid;
+    """, (stale_seconds, max_attempts))
+    scans = cur.fetchall()
+    conn.commit()
+    cur.close()
+    conn.close()
+    return scans
+
+def retry_scan(scan_uid, attempts, max_attempts):
+    """
+    Put a run of a scan that finished with failed units back to 'queued',
+    for recovery.py to enqueue again once SCAN_QUEUED_GRACE_SECONDS have
+    passed; the rerun resumes from the scan's checkpoints. Like
+    claim_stale_scans this counts as an attempt, and a scan already retried
+    `max_attempts` times is marked 'error' instead.
+    Returns the new status, or None if this run had been superseded.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE scans
+           SET status = CASE WHEN attempts < %s THEN 'queued' ELSE 'error' END,
+               attempts = attempts + 1, heartbeat_at = NOW()
+         WHERE uid = %s AND status = 'in_progress' AND attempts = %s
+        RETURNING status;
+    """, (max_attempts, scan_uid, attempts))
+    row = cur.fetchone()
+    conn.commit()
+    cur.close()
+    conn.close()
+    return row[0] if row else None
+
+def get_stale_queued_scans(stale_seconds):
+    """
+    Return 'queued' scans that have been waiting longer than `stale_seconds`:
+      [{"scan_uid": ..., "domain_uid": ...}, ...]
+    Most are simply waiting for a worker; recovery.py requeues only the
+    ones whose job never reached Redis, after claiming them with
+    claim_orphaned_scans.
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT s.uid AS scan_uid, d.uid AS domain_uid
+          FROM scans s
+          JOIN domains d ON s.domain_id = d.id
+         WHERE s.status = 'queued'
+           AND COALESCE(s.heartbeat_at, s.created_at) < NOW() - make_interval(secs => %s);
+    """, (stale_seconds,))
+    scans = cur.fetchall()
+    cur.close()
+    conn.close()
+    return scans
+
+def claim_orphaned_scans(scan_uids, stale_seconds):
+    """
+    Claim 'queued' scans for re-enqueueing by refreshing their heartbeat,
+    if they are still 'queued' and older than `stale_seconds`. Only one of
+    several concurrent callers gets each scan back, so a scan is enqueued
+    once even when recovery runs in the scheduler and every worker:
+      [{"scan_uid": ..., "domain_uid": ...}, ...]
+    """
+    if not scan_uids:
+        return []
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        UPDATE scans s
+           SET heartbeat_at = NOW()
+          FROM domains d
+         WHERE s.domain_id = d.id
+           AND s.uid = ANY(%s::uuid[])
+           AND s.status = 'queued'
+           AND COALESCE(s.heartbeat_at, s.created_at) < NOW() - make_interval(secs => %s)
+        RETURNING s.uid AS scan_uid, d.uid AS domain_uid;
+    """, (list(scan_uids), stale_seconds))
+    scans = cur.fetchall()
+    conn.commit()
+    cur.close()
+    conn.close()
+    return scans
+
+def get_checkpoints(scan_id, stage):
+    """
+    Return the set of units already completed for a stage of a scan.
+    `scan_id` must be the integer primary key from `scans.id`.
     """
     conn = get_connection()
     cur = conn.cursor()
     cur.execute("""
-        UPDATE scans SET status = %s WHERE uid = %s;
-    """, (status, scan_uid))
+        SELECT unit FROM scan_checkpoints WHERE scan_id = %s AND stage = %s;
+    """, (scan_id, stage))
+    units = {row[0] for row in cur.fetchall()}
+    cur.close()
+    conn.close()
+    return units
+
+def mark_checkpoint(scan_id, stage, unit=""):
+    """
+    Record that a unit of work for a scan stage is complete.
+    `scan_id` must be the integer primary key from `scans.id`.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO scan_checkpoints (scan_id, stage, unit)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (scan_id, stage, unit) DO NOTHING;
+    """, (scan_id, stage, unit))
     conn.commit()
     cur.close()
     conn.close()
@@ -240,65 +681,201 @@ ALERT_SEVERITY_MAP = {
     "Storable and Cacheable Content": "Informational" 
 }
 
+def resolve_severity(alert_data):
+    """
+    Return the severity we store for a ZAP alert.
+    If the alert name is in ALERT_SEVERITY_MAP it overrides ZAP's severity.
+    ZAP's alert API reports the severity as `risk`; `severity` is kept as a
+    fallback for alerts stored in that shape.
+    """
+    name = alert_data.get("name", "")
+    zap_severity = alert_data.get("risk") or alert_data.get("severity") or "Unknown"
+    return ALERT_SEVERITY_MAP.get(name, zap_severity)
+
 def insert_alert(endpoint_id, alert_data):
+    insert_alerts([(endpoint_id, alert_data)])
+
+def insert_alerts(rows):
+    """
+    Insert a batch of alerts in a single transaction.
+    `rows` is a list of (endpoint_id, alert_data) pairs. Each alert is also
+    appended to its endpoint's `alerts` array and counted in finding_rollups.
+    """
+    if not rows:
+        return
+
+    values = []
+    for endpoint_id, alert_data in rows:
+        # If name is in ALERT_SEVERITY_MAP, it overrides the ZAP severity
+        values.append((
+            endpoint_id,
+            alert_data.get("name", ""),
+            alert_data.get("description"),
+            alert_data.get("url"),
+            alert_data.get("method", "GET"),
+            alert_data.get("parameter"),
+            alert_data.get("attack"),
+            alert_data.get("evidence"),
+            alert_data.get("other_info"),
+            alert_data.get("instances", 1),
+            alert_data.get("solution"),
+            alert_data.get("references", []),
+            resolve_severity(alert_data),
+            alert_data.get("cwe_id"),
+            alert_data.get("wasc_id"),
+            alert_data.get("plugin_id"),
+        ))
+
     conn = get_connection()
     cur = conn.cursor()
 
-    name = alert_data.get("name", "")
-    zap_severity = alert_data.get("severity", "Unknown")
-    # If name is in the map, override the severity
-    custom_severity = ALERT_SEVERITY_MAP.get(name, zap_severity)
+    # One statement: insert the alerts, link them to their endpoints and
+    # keep the account-wide rollup in step
+    execute_values(cur, """
+        WITH inserted AS (
+            INSERT INTO alerts (
+                endpoint_id, name, description, url, method, parameter, attack, evidence,
+                other_info, instances, solution, references_list, severity,
+                cwe_id, wasc_id, plugin_id
+            ) VALUES %s
+            RETURNING id, endpoint_id, name, severity
+        ), linked AS (
+            UPDATE endpoints e
+               SET alerts = e.alerts || i.ids
+              FROM (
+                SELECT endpoint_id, array_agg(id) AS ids FROM inserted GROUP BY endpoint_id
+              ) i
+             WHERE e.id = i.endpoint_id
+        )
+        INSERT INTO finding_rollups (
+            account_id, domain_id, scan_id, severity, alert_name, alert_count
+        )
+        SELECT d.account_id, d.id, s.id, i.severity, i.name, COUNT(*)
+          FROM inserted i
+          JOIN endpoints e ON i.endpoint_id = e.id
+          JOIN scans s ON e.scan_id = s.id
+          JOIN domains d ON s.domain_id = d.id
+         GROUP BY d.account_id, d.id, s.id, i.severity, i.name
+        ON CONFLICT (account_id, domain_id, scan_id, severity, alert_name)
+        DO UPDATE SET alert_count = finding_rollups.alert_count + EXCLUDED.alert_count,
+                      updated_at = NOW();
+    """, values, page_size=len(values))
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
 
-    # Then do your INSERT with custom_severity
+def insert_subdomain(scan_id, subdomain, resolution=None):
+    """
+    Insert a subdomain into the 'subdomains' table.
+    `scan_id` must be the integer primary key from `scans.id`.
+    `resolution` is an optional result dict from dns_resolution.resolve_subdomains.
+    """
+    resolution = resolution or {}
+    conn = get_connection()
+    cur = conn.cursor()
     cur.execute("""
-        INSERT INTO alerts (
-            endpoint_id, name, description, url, method, parameter, attack, evidence,
-            other_info, instances, solution, references_list, severity,
-            cwe_id, wasc_id, plugin_id
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id;
+        INSERT INTO subdomains (
+            scan_id, subdomain, resolved, ips, cname, is_wildcard, crawl_host
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s);
     """, (
-        endpoint_id,
-        name,
-        alert_data.get("description"),
-        alert_data.get("url"),
-        alert_data.get("method", "GET"),
-        alert_data.get("parameter"),
-        alert_data.get("attack"),
-        alert_data.get("evidence"),
-        alert_data.get("other_info"),
-        alert_data.get("instances", 1),
-        alert_data.get("solution"),
-        alert_data.get("references", []),
-        custom_severity,
-        alert_data.get("cwe_id"),
-        alert_data.get("wasc_id"),
-        alert_data.get("plugin_id"),
+        scan_id,
+        subdomain,
+        resolution.get("resolved"),
+        resolution.get("ips", []),
+        resolution.get("cname"),
+        resolution.get("is_wildcard", False),
+        resolution.get("crawl_host"),
     ))
-    alert_id = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    conn.close()
 
+def delete_subdomains(scan_id):
+    """
+    Remove all subdomains stored for a scan.
+    Used to drop a partial insert left behind by an interrupted run.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
     cur.execute("""
-        UPDATE endpoints
-        SET alerts = array_append(alerts, %s)
-        WHERE id = %s;
-    """, (alert_id, endpoint_id))
-
+        DELETE FROM subdomains WHERE scan_id = %s;
+    """, (scan_id,))
     conn.commit()
     cur.close()
     conn.close()
 
+def get_subdomain_resolutions(scan_id):
+    """
+    Return the stored subdomains of a scan in the same shape as
+    dns_resolution.resolve_subdomains results.
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT subdomain, resolved, ips, cname, is_wildcard, crawl_host
+          FROM subdomains
+         WHERE scan_id = %s
+         ORDER BY subdomain;
+    """, (scan_id,))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [dict(r) for r in rows]
 
-def insert_subdomain(scan_id, subdomain):
+def get_endpoint_id_by_url(scan_id, url):
     """
-    Insert a subdomain into the 'subdomains' table.
-    `scan_id` must be the integer primary key from `scans.id`.
+    Retrieve the integer ID of a scan's endpoint with the given URL, if any.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id FROM endpoints WHERE scan_id = %s AND url = %s ORDER BY id LIMIT 1;
+    """, (scan_id, url))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return row[0] if row else None
+
+def get_scan_endpoints(scan_id):
+    """
+    Return [{"id": ..., "url": ...}, ...] for every endpoint of a scan.
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT id, url FROM endpoints WHERE scan_id = %s ORDER BY id;
+    """, (scan_id,))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def clear_endpoint_alerts(scan_id, endpoint_ids):
+    """
+    Delete every alert stored for the given endpoints of a scan and take
+    them back out of finding_rollups, so they can be scanned again from scratch.
     """
     conn = get_connection()
     cur = conn.cursor()
     cur.execute("""
-        INSERT INTO subdomains (scan_id, subdomain)
-        VALUES (%s, %s);
-    """, (scan_id, subdomain))
+        WITH deleted AS (
+            DELETE FROM alerts WHERE endpoint_id = ANY(%s)
+            RETURNING name, COALESCE(severity, 'Unknown') AS severity
+        ), counts AS (
+            SELECT name, severity, COUNT(*) AS n FROM deleted GROUP BY name, severity
+        )
+        UPDATE finding_rollups r
+           SET alert_count = r.alert_count - c.n, updated_at = NOW()
+          FROM counts c
+         WHERE r.scan_id = %s
+           AND r.alert_name = c.name
+           AND r.severity = c.severity;
+    """, (list(endpoint_ids), scan_id))
+    cur.execute("""
+        UPDATE endpoints SET alerts = ARRAY[]::UUID[] WHERE id = ANY(%s);
+    """, (list(endpoint_ids),))
     conn.commit()
     cur.close()
     conn.close()
@@ -545,3 +1122,153 @@ def get_endpoint_with_alerts(endpoint_uid):
         "alerts": alerts
     }
 
+
+def get_account_findings(account_uid, severities=None, alert_name=None,
+                         domain_uid=None, scan_uid=None, latest_only=True):
+    """
+    Aggregate alert counts for an account from the finding_rollups table.
+    Returns:
+      {
+        "account_uid": ...,
+        "total": ...,
+        "by_severity": {"High": ..., ...},
+        "by_alert_name": [{"alert_name": ..., "severity": ..., "count": ...}],
+        "by_domain": [{"domain_uid": ..., "domain_name": ..., "count": ...}]
+      }
+    or None if the account does not exist.
+    By default only each domain's most recent *complete* scan is counted.
+    With latest_only=False the counts of every scan are added together, so
+    a domain scanned N times contributes its findings N times.
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    cur.execute("SELECT id FROM accounts WHERE uid = %s;", (account_uid,))
+    account = cur.fetchone()
+    if not account:
+        cur.close()
+        conn.close()
+        return None
+
+    conditions = ["r.account_id = %s", "r.alert_count > 0"]
+    params = [account["id"]]
+    if severities:
+        conditions.append("r.severity = ANY(%s)")
+        params.append(list(severities))
+    if alert_name:
+        conditions.append("r.alert_name = %s")
+        params.append(alert_name)
+    if domain_uid:
+        conditions.append("d.uid = %s")
+        params.append(domain_uid)
+    if scan_uid:
+        conditions.append("s.uid = %s")
+        params.append(scan_uid)
+    # An explicit scan_uid picks the scan, so the latest filter does not apply
+    if latest_only and not scan_uid:
+        conditions.append(
+            "s.id = (SELECT MAX(s2.id) FROM scans s2"
+            " WHERE s2.domain_id = r.domain_id AND s2.status = 'complete')"
+        )
+
+    filtered = f"""
+        SELECT r.severity, r.alert_name, r.alert_count,
+               d.uid AS domain_uid, d.domain_name
+          FROM finding_rollups r
+          JOIN domains d ON r.domain_id = d.id
+          JOIN scans s ON r.scan_id = s.id
+         WHERE {" AND ".join(conditions)}
+    """
+
+    cur.execute(f"""
+        SELECT severity, SUM(alert_count) AS count
+          FROM ({filtered}) f
+         GROUP BY severity
+         ORDER BY severity;
+    """, params)
+    by_severity = {r["severity"]: int(r["count"]) for r in cur.fetchall()}
+
+    cur.execute(f"""
+        SELECT alert_name, severity, SUM(alert_count) AS count
+          FROM ({filtered}) f
+         GROUP BY alert_name, severity
+         ORDER BY count DESC, alert_name;
+    """, params)
+    by_alert_name = [
+        {"alert_name": r["alert_name"], "severity": r["severity"], "count": int(r["count"])}
+        for r in cur.fetchall()
+    ]
+
+    cur.execute(f"""
+        SELECT domain_uid, domain_name, SUM(alert_count) AS count
+          FROM ({filtered}) f
+         GROUP BY domain_uid, domain_name
+         ORDER BY count DESC, domain_name;
+    """, params)
+    by_domain = [
+        {"domain_uid": r["domain_uid"], "domain_name": r["domain_name"], "count": int(r["count"])}
+        for r in cur.fetchall()
+    ]
+
+    cur.close()
+    conn.close()
+
+    return {
+        "account_uid": account_uid,
+        "total": sum(by_severity.values()),
+        "by_severity": by_severity,
+        "by_alert_name": by_alert_name,
+        "by_domain": by_domain
+    }
+
+
+EXPORT_COLUMNS = [
+    "endpoint_uid", "subdomain", "endpoint_url", "status_code",
+    "content_type", "server", "framework", "endpoint_created_at",
+    "alert_uid", "name", "description", "url", "method",
+    "parameter", "attack", "evidence", "other_info", "instances",
+    "solution", "references_list", "severity", "cwe_id", "wasc_id",
+    "plugin_id", "alert_created_at"
+]
+
+def iter_scan_export_rows(scan_uid, offset=0, fetch_size=1000):
+    """
+    Yield one flat row per (endpoint, alert) pair for a scan, in a stable
+    order so a client can resume from a row offset.
+    Endpoints without alerts yield a single row with empty alert columns.
+    Uses a named (server-side) cursor so only `fetch_size` rows are held
+    in memory at a time.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cur.itersize = fetch_size
+        cur.execute("""
+            SELECT e.uid AS endpoint_uid,
+                   e.subdomain, e.url AS endpoint_url, e.status_code,
+                   e.content_type, e.server, e.framework,
+                   e.created_at AS endpoint_created_at,
+                   a.id AS alert_uid,
+                   a.name, a.description, a.url, a.method,
+                   a.parameter, a.attack, a.evidence,
+                   a.other_info, a.instances,
+                   a.solution, a.references_list,
+                   a.severity, a.cwe_id, a.wasc_id,
+                   a.plugin_id, a.created_at AS alert_created_at
+              FROM scans s
+              JOIN endpoints e ON e.scan_id = s.id
+         LEFT JOIN alerts a ON a.endpoint_id = e.id
+             WHERE s.uid = %s
+             ORDER BY e.id, a.created_at, a.id
+            OFFSET %s;
+        """, (scan_uid, offset))
+        for row in cur:
+            yield row
+        cur.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Schema setup runs once per deploy, not on every web worker boot
+    init_db()
@@ -0,0 +1,237 @@
+# dns_resolution.py
+import asyncio
+import json
+import os
+import random
+import string
+import time
+
+DNS_CONCURRENCY = int(os.getenv("DNS_CONCURRENCY", "100"))
+DNS_TIMEOUT = float(os.getenv("DNS_TIMEOUT", "3"))
+# Hosts that resolve to the same IPs are crawled once; disable for CDN-heavy targets
+DNS_GROUP_BY_IP = os.getenv("DNS_GROUP_BY_IP", "true").lower() == "true"
+# How long failed / empty lookups are cached for
+NEGATIVE_TTL = 60
+
+RECORD_TYPES = ("A", "AAAA", "CNAME")
+
+
+class DnspythonResolver:
+    """
+    Default resolver, backed by dnspython's asyncio resolver.
+    Any object with an async `query(name, rdtype)` returning
+    (records, ttl) can be used in its place, e.g. a stub in tests.
+    """
+
+    def __init__(self, timeout=DNS_TIMEOUT):
+        import dns.asyncresolver
+        self._resolver = dns.asyncresolver.Resolver()
+        self._resolver.lifetime = timeout
+
+    async def query(self, name, rdtype):
+        import dns.exception
+        try:
+            answer = await self._resolver.resolve(name, rdtype, raise_on_no_answer=False)
+        except dns.exception.DNSException:
+            return [], NEGATIVE_TTL
+        if answer.rrset is None:
+            return [], NEGATIVE_TTL
+        records = [r.to_text().rstrip(".") for r in answer.rrset]
+        return records, answer.rrset.ttl
+
+
+class DNSCache:
+    """
+    In-memory cache of (name, rdtype) -> records, honouring record TTLs.
+    Lives only as long as the object; useful for tests and one-off runs.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._entries = {}
+
+    def prefetch(self, keys):
+        pass
+
+    def flush(self):
+        pass
+
+    def get(self, name, rdtype):
+        entry = self._entries.get((name, rdtype))
+        if entry is None:
+            return None
+        records, expires_at = entry
+        if expires_at <= self._clock():
+            del self._entries[(name, rdtype)]
+            return None
+        return records
+
+    def set(self, name, rdtype, records, ttl):
+        self._entries[(name, rdtype)] = (records, self._clock() + ttl)
+
+
+class RedisDNSCache:
+    """
+    DNS cache shared by every worker, stored in Redis with each entry
+    expiring after its record TTL. RQ runs each job in a fresh forked
+    process, so an in-process cache would not outlive a single scan.
+
+    Lookups run inside the event loop, so Redis is not called per lookup:
+    prefetch() loads every key the scan needs in one MGET, and set()
+    buffers writes until flush() sends them in one pipeline.
+    """
+
+    def __init__(self, redis=None, prefix="dns:"):
+        if redis is None:
+            from jobs import redis_conn
+            redis = redis_conn
+        self._redis = redis
+        self._prefix = prefix
+        self._local = {}
+        self._pending = {}
+
+    def _key(self, name, rdtype):
+        return f"{self._prefix}{rdtype}:{name}"
+
+    def prefetch(self, keys):
+        keys = [k for k in keys if k not in self._local]
+        if not keys:
+            return
+        values = self._redis.mget([self._key(name, rdtype) for name, rdtype in keys])
+        for key, value in zip(keys, values):
+            if value is not None:
+                self._local[key] = json.loads(value)
+
+    def flush(self):
+        if not self._pending:
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        for (name, rdtype), (records, ttl) in self._pending.items():
+            pipe.setex(self._key(name, rdtype), ttl, json.dumps(records))
+        pipe.execute()
+        self._pending = {}
+
+    def get(self, name, rdtype):
+        return self._local.get((name, rdtype))
+
+    def set(self, name, rdtype, records, ttl):
+        self._local[(name, rdtype)] = records
+        if ttl > 0:
+            self._pending[(name, rdtype)] = (records, int(ttl))
+
+
+async def _lookup(resolver, cache, semaphore, name, rdtype):
+    records = cache.get(name, rdtype)
+    if records is not None:
+        return records
+    async with semaphore:
+        records, ttl = await resolver.query(name, rdtype)
+    cache.set(name, rdtype, records, ttl)
+    return records
+
+
+async def _resolve_host(resolver, cache, semaphore, host):
+    a, aaaa, cname = await asyncio.gather(*[
+        _lookup(resolver, cache, semaphore, host, rdtype) for rdtype in RECORD_TYPES
+    ])
+    ips = sorted(set(a) | set(aaaa))
+    return {
+        "subdomain": host,
+        "resolved": bool(ips),
+        "ips": ips,
+        "cname": cname[0] if cname else None,
+        "is_wildcard": False,
+        "crawl_host": None,
+    }
+
+
+async def _wildcard_ips(resolver, cache, semaphore, zone):
+    """
+    Resolve a random label under `zone`; any answer means wildcard DNS.
+    """
+    label = "".join(random.choices(string.ascii_lowercase + string.digits, k=16))
+    probe = await _resolve_host(resolver, cache, semaphore, f"{label}.{zone}")
+    return set(probe["ips"])
+
+
+async def resolve_subdomains_async(domain, subdomains, resolver=None, cache=None,
+                                   concurrency=DNS_CONCURRENCY):
+    resolver = resolver or DnspythonResolver()
+    cache = cache if cache is not None else RedisDNSCache()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    hosts = sorted(set(h.lower().rstrip(".") for h in subdomains if h))
+    cache.prefetch([(host, rdtype) for host in hosts for rdtype in RECORD_TYPES])
+    results = await asyncio.gather(*[
+        _resolve_host(resolver, cache, semaphore, host) for host in hosts
+    ])
+
+    # Probe every parent zone that has resolved children, e.g. dev.example.com
+    zones = sorted(set(
+        r["subdomain"].split(".", 1)[1] for r in results
+        if r["resolved"] and r["subdomain"] != domain and "." in r["subdomain"]
+    ))
+    wildcard_ips = await asyncio.gather(*[
+        _wildcard_ips(resolver, cache, semaphore, zone) for zone in zones
+    ])
+    wildcards = {zone: ips for zone, ips in zip(zones, wildcard_ips) if ips}
+
+    # A host whose IPs are all served by its zone's wildcard record is noise
+    for r in results:
+        if not r["resolved"] or r["subdomain"] == domain:
+            continue
+        zone = r["subdomain"].split(".", 1)[1]
+        if zone in wildcards and set(r["ips"]) <= wildcards[zone]:
+            r["is_wildcard"] = True
+
+    # Hosts sharing the exact same IP set are crawled through one representative
+    groups = {}
+    for r in results:
+        if not r["resolved"] or r["is_wildcard"]:
+            continue
+        key = tuple(r["ips"]) if DNS_GROUP_BY_IP else r["subdomain"]
+        groups.setdefault(key, r["subdomain"])
+        r["crawl_host"] = groups[key]
+
+    cache.flush()
+    return results
+
+
+def resolve_subdomains(domain, subdomains, resolver=None, cache=None,
+                       concurrency=DNS_CONCURRENCY):
+    """
+    Resolve A/AAAA/CNAME records for every subdomain concurrently.
+    `cache` defaults to the Redis cache shared by all workers.
+    Returns a list of dicts:
+      {
+        "subdomain": ...,
+        "resolved": True/False,
+        "ips": [...],
+        "cname": ... or None,
+        "is_wildcard": True/False,
+        "crawl_host": host that represents this one's IP group, or None
+      }
+    """
+    try:
+        return asyncio.run(resolve_subdomains_async(
+            domain, subdomains, resolver=resolver, cache=cache, concurrency=concurrency
+        ))
+    except Exception as e:
+        print(f"Exception in resolve_subdomains: {e}")
+        # Fall back to crawling everything rather than dropping the scan
+        return [
+            {"subdomain": h, "resolved": None, "ips": [], "cname": None,
+             "is_wildcard": False, "crawl_host": h}
+            for h in sorted(set(subdomains))
+        ]
+
+
+def hosts_to_crawl(resolutions):
+    """
+    Return the subdomains that should be crawled: resolved, not produced by
+    wildcard DNS, and the representative of their IP group.
+    """
+    return [
+        r["subdomain"] for r in resolutions
+        if r["crawl_host"] == r["subdomain"]
+    ]
@@ -0,0 +1,72 @@
+# jobs.py
+import os
+from redis import Redis
+from rq import Queue
+from rq.job import Job
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+# Jobs are referenced by dotted path so that enqueuing them never imports
+# tasks.py (and with it Playwright, BeautifulSoup and requests) in the web process
+SCAN_JOB = "tasks.discover_subdomains_and_endpoints"
+
+# A scan runs for hours, well past RQ's 180 s default. Crashed or hung
+# scans are requeued by the heartbeat check in recovery.py well before this;
+# it only bounds how long a hung job keeps its worker busy.
+SCAN_JOB_TIMEOUT = int(os.getenv("SCAN_JOB_TIMEOUT", str(12 * 60 * 60)))
+
+# RQ job statuses after which a scan's job will not run again
+ENDED_JOB_STATUSES = ("finished", "failed", "stopped", "canceled")
+
+redis_conn = Redis.from_url(REDIS_URL)
+q = Queue("default", connection=redis_conn)
+
+def scan_job_id(scan_uid):
+    """
+    Scan jobs get a fixed ID so recovery.py can tell whether a queued
+    scan's job actually reached Redis.
+    """
+    return f"scan-{scan_uid}"
+
+def missing_scan_jobs(scan_uids, connection=None):
+    """
+    Return the scan UIDs that have no live job in Redis: none stored, or
+    only one that has already ended (e.g. a run that put its scan back to
+    'queued' to retry failed spider roots).
+    """
+    connection = connection or redis_conn
+    pipe = connection.pipeline(transaction=False)
+    for scan_uid in scan_uids:
+        pipe.hget(Job.key_for(scan_job_id(scan_uid)), "status")
+    return [
+        scan_uid for scan_uid, status in zip(scan_uids, pipe.execute())
+        if status is None or status.decode() in ENDED_JOB_STATUSES
+    ]
+
+def enqueue_scan(scan_uid, domain_uid, queue=None):
+    """
+    Enqueue the combined subdomain, endpoint discovery, and ZAP scan job.
+    """
+    return (queue or q).enqueue(
+        SCAN_JOB, scan_uid, domain_uid,
+        job_id=scan_job_id(scan_uid), job_timeout=SCAN_JOB_TIMEOUT,
+    )
+
+def enqueue_scans(scans, queue=None):
+    """
+    Enqueue one scan job per {"scan_uid": ..., "domain_uid": ...} in a
+    single Redis pipeline. Returns the jobs in the same order.
+    """
+    queue = queue or q
+    if not scans:
+        return []
+    with queue.connection.pipeline() as pipe:
+        jobs = queue.enqueue_many([
+            Queue.prepare_data(
+                SCAN_JOB, (s["scan_uid"], s["domain_uid"]),
+                job_id=scan_job_id(s["scan_uid"]), timeout=SCAN_JOB_TIMEOUT,
+            )
+            for s in scans
+        ], pipeline=pipe)
+        pipe.execute()
+    return jobs
@@ -0,0 +1,52 @@
+# recovery.py
+import os
+import time
+
+from db import claim_stale_scans, get_stale_queued_scans, claim_orphaned_scans
+from jobs import enqueue_scans, missing_scan_jobs
+
+# A scan whose heartbeat is older than this is considered abandoned
+SCAN_STALE_SECONDS = int(os.getenv("SCAN_STALE_SECONDS", "600"))
+# A queued scan this old is checked for a job that never reached Redis
+SCAN_QUEUED_GRACE_SECONDS = int(os.getenv("SCAN_QUEUED_GRACE_SECONDS", "300"))
+SCAN_MAX_ATTEMPTS = int(os.getenv("SCAN_MAX_ATTEMPTS", "3"))
+RECOVERY_INTERVAL_SECONDS = int(os.getenv("RECOVERY_INTERVAL_SECONDS", "60"))
+
+def requeue_stale_scans(queue=None):
+    """
+    Requeue 'in_progress' scans whose worker stopped sending heartbeats,
+    and 'queued' scans with no live job in Redis: the enqueue failed after
+    the scan row was committed, or the scan's own run put it back to retry
+    failed spider roots (see db.retry_scan).
+    The rerun resumes from the scan's checkpoints.
+    """
+    scans = [
+        {"scan_uid": str(s["scan_uid"]), "domain_uid": str(s["domain_uid"])}
+        for s in claim_stale_scans(SCAN_STALE_SECONDS, SCAN_MAX_ATTEMPTS)
+    ]
+    # claim_stale_scans has already flipped these to 'queued' and committed;
+    # if the enqueue below fails they are picked up by the check that follows
+    # on a later run
+    for scan in scans:
+        print(f"[+] Requeueing stale scan {scan['scan_uid']}")
+    enqueue_scans(scans, queue=queue)
+
+    queued = [str(s["scan_uid"]) for s in get_stale_queued_scans(SCAN_QUEUED_GRACE_SECONDS)]
+    # Claim in the DB before enqueueing, so a scan found orphaned by several
+    # recovery loops at once is enqueued by only one of them
+    orphans = [
+        {"scan_uid": str(s["scan_uid"]), "domain_uid": str(s["domain_uid"])}
+        for s in claim_orphaned_scans(missing_scan_jobs(queued), SCAN_QUEUED_GRACE_SECONDS)
+    ]
+    for scan in orphans:
+        print(f"[+] Enqueueing orphaned queued scan {scan['scan_uid']}")
+    enqueue_scans(orphans, queue=queue)
+    return len(scans) + len(orphans)
+
+if __name__ == "__main__":
+    while True:
+        try:
+            requeue_stale_scans()
+        except Exception as e:
+            print(f"[-] Error requeueing stale scans: {e}")
+        time.sleep(RECOVERY_INTERVAL_SECONDS)
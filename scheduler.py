@@ -0,0 +1,43 @@
+# scheduler.py
+import os
+import random
+import time
+
+from db import claim_due_schedules
+from jobs import q, enqueue_scans
+from recovery import requeue_stale_scans
+
+SCHEDULER_INTERVAL_SECONDS = int(os.getenv("SCHEDULER_INTERVAL_SECONDS", "30"))
+# Most scans started per tick, so a backlog of due schedules drains gradually
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "50"))
+# Stop starting scans while this many jobs are already waiting for workers
+SCHEDULER_MAX_QUEUE_DEPTH = int(os.getenv("SCHEDULER_MAX_QUEUE_DEPTH", "200"))
+
+def run_due_schedules(queue=None):
+    """
+    Start scans for due schedules, respecting queue backpressure.
+    Returns the number of scans enqueued.
+    """
+    queue = queue or q
+    room = SCHEDULER_MAX_QUEUE_DEPTH - queue.count
+    if room <= 0:
+        print(f"[+] Queue has {queue.count} waiting jobs, deferring scheduled scans")
+        return 0
+
+    scans = claim_due_schedules(min(room, SCHEDULER_BATCH_SIZE))
+    # The scans are already committed; if this enqueue fails,
+    # requeue_stale_scans picks them up as orphaned 'queued' scans
+    enqueue_scans(scans, queue=queue)
+    if scans:
+        print(f"[+] Enqueued {len(scans)} scheduled scans")
+    return len(scans)
+
+if __name__ == "__main__":
+    while True:
+        try:
+            requeue_stale_scans()
+            run_due_schedules()
+        except Exception as e:
+            print(f"[-] Error running scheduler: {e}")
+        # Jitter the tick so several schedulers do not poll in lockstep
+        time.sleep(SCHEDULER_INTERVAL_SECONDS * random.uniform(0.8, 1.2))
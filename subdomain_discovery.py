@@ -1,7 +1,12 @@
 # subdomain_discovery.py
+import os
 import subprocess
 import json
 
+# Bounded so a stuck subfinder stops the scan's heartbeat for no longer than
+# recovery.SCAN_STALE_SECONDS
+SUBFINDER_TIMEOUT_SECONDS = int(os.getenv("SUBFINDER_TIMEOUT_SECONDS", "480"))
+
 def run_subfinder(domain):
     """
     Runs subfinder and returns a list of discovered subdomains.
@@ -9,7 +14,7 @@ def run_subfinder(domain):
     """
     try:
         cmd = ["subfinder", "-d", domain, "-oJ"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=SUBFINDER_TIMEOUT_SECONDS)
         if result.returncode != 0:
             print(f"Error running subfinder: {result.stderr}")
             return []
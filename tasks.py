@@ -1,66 +1,170 @@
 import os
+import time
 import requests
+from contextlib import closing
 from bs4 import BeautifulSoup
 from playwright.sync_api import sync_playwright
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 
 from db import (
-    insert_alert,
     insert_subdomain,
     update_scan_status,
     insert_endpoint,
     get_domain_name_by_uid,
-    get_scan_id_by_uid
+    start_scan,
+    retry_scan,
+    touch_scan_heartbeat,
+    get_checkpoints,
+    mark_checkpoint,
+    delete_subdomains,
+    get_subdomain_resolutions,
+    get_endpoint_id_by_url,
+    get_scan_endpoints,
+    clear_endpoint_alerts
 )
 from subdomain_discovery import run_subfinder
+from dns_resolution import resolve_subdomains, hosts_to_crawl
+from zap_pool import ZapPool, ZapScanSession
+from zap_scan import plan_spider_roots, harvest_alerts
+from recovery import SCAN_MAX_ATTEMPTS
 
-ZAP_API_KEY = os.getenv("ZAP_API_KEY")
-ZAP_BASE_URL = os.getenv("ZAP_BASE_URL")
+# Least time between two writes of scans.heartbeat_at by a running scan
+SCAN_HEARTBEAT_SECONDS = int(os.getenv("SCAN_HEARTBEAT_SECONDS", "30"))
+
+class ScanSuperseded(Exception):
+    """
+    Raised when recovery.py has requeued the scan this worker is running.
+    """
+
+class ScanHeartbeat:
+    """
+    Liveness signal for one run of a scan, driven by the work itself: the
+    scan calls beat() after every unit of work and from ZAP's polling
+    loops, so a worker stuck inside a single call stops beating and
+    recovery.py requeues the scan after SCAN_STALE_SECONDS.
+    If that happens to a worker that was only slow, its next beat() raises
+    ScanSuperseded so it stops instead of racing the new run.
+    """
+
+    def __init__(self, scan_uid, attempts, interval=SCAN_HEARTBEAT_SECONDS):
+        self.scan_uid = scan_uid
+        self.attempts = attempts
+        self.interval = interval
+        self._last = time.monotonic()
+
+    def beat(self):
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        try:
+            alive = touch_scan_heartbeat(self.scan_uid, self.attempts)
+        except Exception as e:
+            print(f"Error updating heartbeat for scan {self.scan_uid}: {e}")
+            return
+        if not alive:
+            raise ScanSuperseded(f"Scan {self.scan_uid} was requeued by recovery.")
 
 def discover_subdomains_and_endpoints(scan_uid, domain_uid):
     """
     Combines subdomain discovery, endpoint discovery, and ZAP passive scanning.
     This function uses the *UUID* for scan_uid, then looks up the integer PK.
     Likewise, it looks up the domain_name from the domain UID.
-    """
-    try:
-        # Mark scan as "in_progress"
-        update_scan_status(scan_uid, "in_progress")
 
-        # Convert the scan UID to the integer scans.id
-        scan_pk = get_scan_id_by_uid(scan_uid)
-        if not scan_pk:
-            raise ValueError(f"Scan UID={scan_uid} not found in DB.")
+    Progress is checkpointed in scan_checkpoints, so a rerun after a crash
+    skips the subdomain enumeration, subdomains, URLs and spider roots
+    already finished.
+    """
+    # Mark scan as "in_progress", unless another worker already has it
+    scan = start_scan(scan_uid)
+    if not scan:
+        print(f"Scan {scan_uid} is not queued, skipping.")
+        return
+    scan_pk = scan["id"]
+    heartbeat = ScanHeartbeat(scan_uid, scan["attempts"])
 
+    try:
         # Get the actual domain name from the domain UID
         domain_name = get_domain_name_by_uid(domain_uid)
         if not domain_name:
             raise ValueError(f"Domain UID={domain_uid} not found in DB.")
 
-        # Subdomain discovery
-        subdomains = run_subfinder(domain_name)  # Pass the real domain name
-        for subdomain in subdomains:
-            insert_subdomain(scan_pk, subdomain)  # Insert with integer PK
-
-        # Endpoint discovery for each subdomain
-        for subdomain in subdomains:
-            discovered_urls = discover_endpoints(subdomain)
-            for url in discovered_urls:
-                ep_data = analyze_api(url)
-                if ep_data:
-                    parsed = urlparse(ep_data["url"])
-                    actual_host = parsed.netloc  # e.g. "www.italotreno.com"
-
-                    endpoint_id = insert_endpoint(scan_pk, actual_host, ep_data)
-                    run_zap_scan(endpoint_id, url)
+        # Closing the session removes this scan's contexts from the ZAP daemons
+        zap = ZapScanSession(ZapPool(), scan_uid, on_progress=heartbeat.beat)
+        with closing(zap):
+            if get_checkpoints(scan_pk, "subdomains"):
+                resolutions = get_subdomain_resolutions(scan_pk)
+            else:
+                # Subdomain discovery
+                subdomains = run_subfinder(domain_name)  # Pass the real domain name
+                heartbeat.beat()
+
+                # Resolve before crawling so dead, wildcard and duplicate hosts are skipped
+                resolutions = resolve_subdomains(domain_name, subdomains)
+                delete_subdomains(scan_pk)  # drop a partial insert from an earlier attempt
+                for resolution in resolutions:
+                    insert_subdomain(scan_pk, resolution["subdomain"], resolution)  # Insert with integer PK
+                mark_checkpoint(scan_pk, "subdomains")
+
+            crawled = get_checkpoints(scan_pk, "crawl")
+            scanned = get_checkpoints(scan_pk, "endpoint")
+
+            # Endpoint discovery for each live subdomain
+            for subdomain in hosts_to_crawl(resolutions):
+                if subdomain in crawled:
+                    continue
+                discovered_urls = discover_endpoints(subdomain)
+                for url in discovered_urls:
+                    if url in scanned:
+                        continue
+                    ep_data = analyze_api(url)
+                    # The row may exist if an earlier run died before the checkpoint
+                    if ep_data and not get_endpoint_id_by_url(scan_pk, url):
+                        parsed = urlparse(ep_data["url"])
+                        actual_host = parsed.netloc  # e.g. "www.italotreno.com"
+                        insert_endpoint(scan_pk, actual_host, ep_data)
+                    mark_checkpoint(scan_pk, "endpoint", url)
+                    scanned.add(url)
+                    heartbeat.beat()
+                mark_checkpoint(scan_pk, "crawl", subdomain)
+                heartbeat.beat()
+
+            # ZAP runs once per origin / path prefix rather than once per URL
+            spidered = get_checkpoints(scan_pk, "zap")
+            failed_roots = []
+            for plan in plan_spider_roots(get_scan_endpoints(scan_pk), domain_name):
+                if plan["root"] in spidered:
+                    continue
+                # Drop partial alerts if an earlier run died mid-harvest
+                clear_endpoint_alerts(scan_pk, [e["id"] for e in plan["endpoints"]])
+                try:
+                    run_zap_scan(zap, plan)
+                except Exception as e:
+                    # No checkpoint, so the retry below runs this root again
+                    print(f"Error running ZAP scan on {plan['root']}: {e}")
+                    failed_roots.append(plan["root"])
+                    continue
+                mark_checkpoint(scan_pk, "zap", plan["root"])
+                heartbeat.beat()
+
+            if failed_roots:
+                # recovery.py enqueues the scan again; it resumes from the
+                # checkpoints, so only the failed roots are rerun
+                status = retry_scan(scan_uid, heartbeat.attempts, SCAN_MAX_ATTEMPTS)
+                print(f"ZAP scan failed for {len(failed_roots)} spider root(s), "
+                      f"scan {scan_uid} is now {status}: {failed_roots}")
+                return
 
         # Mark scan as complete
-        update_scan_status(scan_uid, "complete")
+        update_scan_status(scan_uid, "complete", attempts=heartbeat.attempts)
 
+    except ScanSuperseded as e:
+        # The newer run owns the scan's status now
+        print(f"Stopping superseded scan: {e}")
     except Exception as e:
         print(f"Error in discover_subdomains_and_endpoints: {e}")
         # Mark the scan as failed (error)
-        update_scan_status(scan_uid, "error")
+        update_scan_status(scan_uid, "error", attempts=heartbeat.attempts)
 
 def discover_endpoints(subdomain):
     """
@@ -117,43 +221,16 @@ def analyze_api(url):
         print(f"Error analyzing URL {url}: {e}")
         return None
 
-def run_zap_scan(endpoint_id, url):
+def run_zap_scan(zap, plan):
     """
-    Performs a ZAP spider scan on the given URL, then collects any alerts.
-    endpoint_id is the integer PK of the endpoints row.
+    Performs one ZAP spider scan from a spider root (see zap_scan.plan_spider_roots),
+    seeded with the root's known endpoint URLs, then collects the alerts once
+    and stores each against its endpoint.
+    `zap` is the scan's ZapScanSession.
+    Raises on any ZAP failure, so the caller only checkpoints roots that
+    were actually harvested.
     """
-    try:
-        # Start ZAP Spider
-        response = requests.get(
-            f"{ZAP_BASE_URL}/JSON/spider/action/scan/",
-            params={"apikey": ZAP_API_KEY, "url": url, "maxChildren": 10},
-        )
-        response.raise_for_status()
-        scan_id = response.json().get("scan")
-        if not scan_id:
-            print(f"Failed to start ZAP Spider for {url}")
-            return
-
-        # Poll Spider Status until it's 100%
-        while True:
-            status_response = requests.get(
-                f"{ZAP_BASE_URL}/JSON/spider/view/status/",
-                params={"apikey": ZAP_API_KEY, "scanId": scan_id},
-            )
-            status_response.raise_for_status()
-            if status_response.json().get("status") == "100":
-                break
-
-        # Retrieve ZAP Alerts
-        alerts_response = requests.get(
-            f"{ZAP_BASE_URL}/JSON/core/view/alerts/",
-            params={"apikey": ZAP_API_KEY, "baseurl": url},
-        )
-        alerts_response.raise_for_status()
-        alerts = alerts_response.json().get("alerts", [])
-
-        for alert in alerts:
-            insert_alert(endpoint_id, alert)
-
-    except Exception as e:
-        print(f"Error running ZAP scan on {url}: {e}")
+    root = plan["root"]
+    seeds = [e["url"] for e in plan["endpoints"]]
+    with zap.spider(root, max_children=10, seeds=seeds) as (daemon, renew):
+        harvest_alerts(daemon, root, plan["endpoints"], renew=renew)
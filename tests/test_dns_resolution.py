@@ -0,0 +1,91 @@
+from dns_resolution import DNSCache, hosts_to_crawl, resolve_subdomains
+
+
+class StubResolver:
+    """
+    Answers from a fixed table of {(name, rdtype): records}. Names under a
+    zone in `wildcards` that are not in the table get the zone's wildcard IPs.
+    """
+
+    def __init__(self, records, wildcards=None, ttl=300):
+        self.records = records
+        self.wildcards = wildcards or {}
+        self.ttl = ttl
+        self.queries = []
+
+    async def query(self, name, rdtype):
+        self.queries.append((name, rdtype))
+        if (name, rdtype) in self.records:
+            return self.records[(name, rdtype)], self.ttl
+        zone = name.split(".", 1)[1] if "." in name else ""
+        if rdtype == "A" and zone in self.wildcards:
+            return self.wildcards[zone], self.ttl
+        return [], self.ttl
+
+
+def by_host(results):
+    return {r["subdomain"]: r for r in results}
+
+
+def test_dead_host_is_not_crawled():
+    resolver = StubResolver({("www.example.com", "A"): ["192.0.2.1"]})
+    results = by_host(resolve_subdomains(
+        "example.com", ["www.example.com", "gone.example.com"], resolver=resolver, cache=DNSCache()
+    ))
+
+    assert results["www.example.com"]["resolved"] is True
+    assert results["gone.example.com"]["resolved"] is False
+    assert results["gone.example.com"]["crawl_host"] is None
+    assert hosts_to_crawl(results.values()) == ["www.example.com"]
+
+
+def test_wildcard_hosts_are_flagged():
+    resolver = StubResolver(
+        {("api.dev.example.com", "A"): ["192.0.2.20"]},
+        wildcards={"dev.example.com": ["192.0.2.10"]},
+    )
+    results = by_host(resolve_subdomains(
+        "example.com", ["api.dev.example.com", "junk.dev.example.com"], resolver=resolver, cache=DNSCache()
+    ))
+
+    assert results["junk.dev.example.com"]["is_wildcard"] is True
+    assert results["junk.dev.example.com"]["crawl_host"] is None
+    # A real record that differs from the wildcard answer is kept
+    assert results["api.dev.example.com"]["is_wildcard"] is False
+    assert hosts_to_crawl(results.values()) == ["api.dev.example.com"]
+
+
+def test_hosts_sharing_ips_are_crawled_once():
+    resolver = StubResolver({
+        ("a.example.com", "A"): ["192.0.2.1"],
+        ("b.example.com", "A"): ["192.0.2.1"],
+        ("c.example.com", "A"): ["192.0.2.2"],
+        ("c.example.com", "CNAME"): ["lb.example.net"],
+    })
+    results = by_host(resolve_subdomains(
+        "example.com", ["b.example.com", "a.example.com", "c.example.com"], resolver=resolver, cache=DNSCache()
+    ))
+
+    assert results["a.example.com"]["crawl_host"] == "a.example.com"
+    assert results["b.example.com"]["crawl_host"] == "a.example.com"
+    assert results["c.example.com"]["cname"] == "lb.example.net"
+    assert hosts_to_crawl(results.values()) == ["a.example.com", "c.example.com"]
+
+
+def test_cache_answers_repeat_lookups_until_ttl():
+    now = [0.0]
+    cache = DNSCache(clock=lambda: now[0])
+    resolver = StubResolver({("www.example.com", "A"): ["192.0.2.1"]}, ttl=60)
+
+    def www_queries():
+        # Wildcard probes use a fresh random label every run, so only the host is counted
+        return [q for q in resolver.queries if q[0] == "www.example.com"]
+
+    resolve_subdomains("example.com", ["www.example.com"], resolver=resolver, cache=cache)
+    assert len(www_queries()) == 3
+    resolve_subdomains("example.com", ["www.example.com"], resolver=resolver, cache=cache)
+    assert len(www_queries()) == 3
+
+    now[0] = 61
+    resolve_subdomains("example.com", ["www.example.com"], resolver=resolver, cache=cache)
+    assert len(www_queries()) == 6
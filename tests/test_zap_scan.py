@@ -0,0 +1,54 @@
+from zap_scan import match_endpoint, plan_spider_roots
+
+
+def endpoint_index(urls):
+    endpoint_ids = {url: i for i, url in enumerate(urls)}
+    return endpoint_ids, sorted({len(u) for u in endpoint_ids}, reverse=True)
+
+
+def test_match_endpoint_stops_at_path_boundaries():
+    endpoint_ids, url_lengths = endpoint_index(["https://a.com/", "https://a.com/x/a"])
+
+    assert match_endpoint("https://a.com/x/a", endpoint_ids, url_lengths) == 1
+    assert match_endpoint("https://a.com/x/a/b", endpoint_ids, url_lengths) == 1
+    assert match_endpoint("https://a.com/x/a?q=1", endpoint_ids, url_lengths) == 1
+    assert match_endpoint("https://a.com/x/a#top", endpoint_ids, url_lengths) == 1
+    # Not a child of /x/a, so it falls back to the origin's endpoint
+    assert match_endpoint("https://a.com/x/apple", endpoint_ids, url_lengths) == 0
+    assert match_endpoint("https://b.com/", endpoint_ids, url_lengths) is None
+
+
+def test_match_endpoint_does_not_cross_hosts():
+    endpoint_ids, url_lengths = endpoint_index(["https://a.com"])
+
+    assert match_endpoint("https://a.com/login", endpoint_ids, url_lengths) == 0
+    assert match_endpoint("https://a.com.evil.net/", endpoint_ids, url_lengths) is None
+
+
+def test_plan_spider_roots_uses_common_directory_per_origin():
+    endpoints = [
+        {"id": 1, "url": "https://www.example.com/app/js/main.js"},
+        {"id": 2, "url": "https://www.example.com/app/login"},
+        {"id": 3, "url": "https://api.example.com/v1/users"},
+    ]
+
+    plans = {p["root"]: [e["id"] for e in p["endpoints"]] for p in plan_spider_roots(endpoints, "example.com")}
+
+    assert plans == {
+        "https://api.example.com/v1/": [3],
+        "https://www.example.com/app/": [1, 2],
+    }
+
+
+def test_plan_spider_roots_skips_third_party_origins():
+    endpoints = [
+        {"id": 1, "url": "https://example.com/"},
+        {"id": 2, "url": "https://cdn.jsdelivr.net/npm/lib.js"},
+        {"id": 3, "url": "https://www.googletagmanager.com/gtm.js"},
+        {"id": 4, "url": "https://notexample.com/"},
+        {"id": 5, "url": "https://WWW.Example.com:8443/"},
+    ]
+
+    roots = [p["root"] for p in plan_spider_roots(endpoints, "example.com")]
+
+    assert roots == ["https://WWW.Example.com:8443/", "https://example.com/"]
@@ -3,12 +3,24 @@ import os
 from rq import Worker, Queue, Connection
 from redis import Redis
 
+from recovery import requeue_stale_scans
+# Import the task module (Playwright, BeautifulSoup, requests) once in the
+# worker parent so every forked job horse inherits it already loaded.
+# The web process enqueues by dotted path and never imports it.
+import tasks  # noqa: F401
+
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 listen = ["default"]
 
 redis_conn = Redis.from_url(REDIS_URL)
 
 if __name__ == "__main__":
+    # Pick up scans abandoned by a worker that crashed or was redeployed
+    try:
+        requeue_stale_scans(Queue("default", connection=redis_conn))
+    except Exception as e:
+        print(f"Error requeueing stale scans: {e}")
+
     with Connection(redis_conn):
         worker = Worker(map(Queue, listen))
         worker.work()
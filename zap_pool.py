@@ -0,0 +1,291 @@
+# zap_pool.py
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+from jobs import redis_conn
+
+ZAP_API_KEY = os.getenv("ZAP_API_KEY")
+# Comma-separated list of ZAP daemons; falls back to the single ZAP_BASE_URL
+ZAP_BASE_URLS = [
+    u.strip().rstrip("/")
+    for u in (os.getenv("ZAP_BASE_URLS") or os.getenv("ZAP_BASE_URL") or "").split(",")
+    if u.strip()
+]
+ZAP_MAX_SPIDERS_PER_DAEMON = int(os.getenv("ZAP_MAX_SPIDERS_PER_DAEMON", "4"))
+# A spider slot held by a worker that died is released after this long
+ZAP_LEASE_SECONDS = int(os.getenv("ZAP_LEASE_SECONDS", "900"))
+ZAP_ACQUIRE_TIMEOUT_SECONDS = int(os.getenv("ZAP_ACQUIRE_TIMEOUT_SECONDS", "1800"))
+# A spider still running after this long is stopped and its root fails
+ZAP_SPIDER_TIMEOUT_SECONDS = int(os.getenv("ZAP_SPIDER_TIMEOUT_SECONDS", "1800"))
+ZAP_HEALTH_TTL_SECONDS = 30
+ZAP_POLL_SECONDS = 2
+ZAP_REQUEST_TIMEOUT = 30
+
+# Take a spider slot on one daemon if it is under its cap and no other
+# scan holds the origin there. ZAP's site tree and alerts are shared by
+# everything on a daemon, so an origin is worked by one scan at a time.
+# KEYS[1] = lease sorted set, KEYS[2] = origin lock
+# ARGV = now, cap, lease_id, expires_at, lock ttl (ms)
+ACQUIRE_LEASE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[3])
+redis.call('SET', KEYS[2], ARGV[3], 'PX', ARGV[5])
+return 1
+"""
+
+# KEYS[1] = lease sorted set, KEYS[2] = origin lock; ARGV = lease_id, expires_at, lock ttl (ms)
+RENEW_LEASE_SCRIPT = """
+redis.call('ZADD', KEYS[1], 'XX', ARGV[2], ARGV[1])
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[2], ARGV[3])
+end
+"""
+
+# KEYS[1] = lease sorted set, KEYS[2] = origin lock; ARGV = lease_id
+RELEASE_LEASE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('DEL', KEYS[2])
+end
+"""
+
+
+class ZapDaemon:
+    """
+    A single ZAP instance reachable over its JSON API.
+    """
+
+    def __init__(self, base_url, api_key=ZAP_API_KEY):
+        self.base_url = base_url
+        self.api_key = api_key
+        self._healthy = None
+        self._checked_at = 0
+
+    def get(self, path, **params):
+        response = requests.get(
+            f"{self.base_url}{path}",
+            params={"apikey": self.api_key, **params},
+            timeout=ZAP_REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def is_healthy(self):
+        """
+        Ping the daemon, caching the answer for ZAP_HEALTH_TTL_SECONDS.
+        """
+        now = time.monotonic()
+        if self._healthy is None or now - self._checked_at > ZAP_HEALTH_TTL_SECONDS:
+            try:
+                self.get("/JSON/core/view/version/")
+                self._healthy = True
+            except Exception as e:
+                print(f"[-] ZAP daemon {self.base_url} failed health check: {e}")
+                self._healthy = False
+            self._checked_at = now
+        return self._healthy
+
+
+class ZapPool:
+    """
+    Dispatches spiders to the least-loaded healthy ZAP daemon.
+    Spider slots and origin locks live in Redis, so the per-daemon cap
+    and the one-scan-per-origin rule hold across every worker process.
+    """
+
+    def __init__(self, base_urls=None, redis=None, max_spiders=ZAP_MAX_SPIDERS_PER_DAEMON):
+        self.daemons = [ZapDaemon(u) for u in (base_urls or ZAP_BASE_URLS)]
+        if not self.daemons:
+            raise ValueError("No ZAP daemons configured (set ZAP_BASE_URLS or ZAP_BASE_URL).")
+        self.redis = redis or redis_conn
+        self.max_spiders = max_spiders
+        self._acquire = self.redis.register_script(ACQUIRE_LEASE_SCRIPT)
+        self._renew = self.redis.register_script(RENEW_LEASE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+
+    def _lease_key(self, daemon):
+        return f"zap:leases:{daemon.base_url}"
+
+    def _origin_key(self, daemon, origin):
+        return f"zap:origin:{daemon.base_url}:{origin}"
+
+    def loads(self, daemons):
+        """
+        Return the number of live spider leases on each daemon.
+        """
+        now = time.time()
+        pipe = self.redis.pipeline()
+        for daemon in daemons:
+            pipe.zcount(self._lease_key(daemon), now, "+inf")
+        return pipe.execute()
+
+    @contextmanager
+    def lease(self, origin, timeout=ZAP_ACQUIRE_TIMEOUT_SECONDS, on_wait=None):
+        """
+        Hold a spider slot on the least-loaded healthy daemon, together with
+        that daemon's lock on `origin`.
+        Yields (daemon, renew) where renew() extends both.
+        `on_wait` is called on every poll while all daemons are busy.
+        """
+        lease_id = uuid.uuid4().hex
+        lock_ms = ZAP_LEASE_SECONDS * 1000
+        deadline = time.monotonic() + timeout
+        daemon = None
+        while daemon is None:
+            healthy = [d for d in self.daemons if d.is_healthy()]
+            if healthy:
+                ranked = sorted(zip(self.loads(healthy), range(len(healthy))))
+                for _, i in ranked:
+                    now = time.time()
+                    acquired = self._acquire(
+                        keys=[self._lease_key(healthy[i]), self._origin_key(healthy[i], origin)],
+                        args=[now, self.max_spiders, lease_id, now + ZAP_LEASE_SECONDS, lock_ms],
+                    )
+                    if acquired:
+                        daemon = healthy[i]
+                        break
+            if daemon is None:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Timed out waiting for a free ZAP daemon for {origin}.")
+                if on_wait:
+                    on_wait()
+                time.sleep(ZAP_POLL_SECONDS)
+
+        keys = [self._lease_key(daemon), self._origin_key(daemon, origin)]
+
+        def renew():
+            self._renew(keys=keys, args=[lease_id, time.time() + ZAP_LEASE_SECONDS, lock_ms])
+
+        try:
+            yield daemon, renew
+        finally:
+            self._release(keys=keys, args=[lease_id])
+
+
+class ZapScanSession:
+    """
+    Per-scan view of the pool. Each daemon the scan touches gets a ZAP
+    context named after the scan; spiders run inside it. A spider root's
+    site node (history and alerts) is deleted as soon as its alerts are
+    harvested, and close() removes the contexts.
+    `on_progress` is called from every ZAP polling loop, so the scan's
+    heartbeat keeps moving while ZAP works and stops if ZAP stops answering.
+    """
+
+    def __init__(self, pool, scan_uid, on_progress=None):
+        self.pool = pool
+        self.context_name = f"scan-{scan_uid}"
+        self.on_progress = on_progress
+        self._origins = {}  # base_url -> (daemon, set of origins)
+
+    def _progress(self):
+        if self.on_progress:
+            self.on_progress()
+
+    def _include(self, daemon, origin):
+        daemon_entry = self._origins.get(daemon.base_url)
+        if daemon_entry is None:
+            try:
+                daemon.get("/JSON/context/action/newContext/", contextName=self.context_name)
+            except requests.HTTPError:
+                # Left behind by an earlier, interrupted run of this scan
+                pass
+            daemon_entry = self._origins[daemon.base_url] = (daemon, set())
+        if origin not in daemon_entry[1]:
+            daemon.get(
+                "/JSON/context/action/includeInContext/",
+                contextName=self.context_name,
+                regex=f"^{re.escape(origin)}.*",
+            )
+            daemon_entry[1].add(origin)
+
+    def _delete_site_node(self, daemon, url):
+        # ZAP may key the node with or without the trailing slash
+        for node_url in dict.fromkeys([url, url.rstrip("/")]):
+            try:
+                daemon.get("/JSON/core/action/deleteSiteNode/", url=node_url)
+            except Exception:
+                pass
+
+    @contextmanager
+    def spider(self, url, max_children=10, seeds=(), timeout=ZAP_SPIDER_TIMEOUT_SECONDS):
+        """
+        Spider `url` inside the scan's context on the least-loaded daemon.
+        Yields (daemon, keepalive): the daemon now holds the alerts for `url`,
+        and harvesting must happen inside the block, while this scan holds
+        the daemon's lock on the origin. On exit the site node for `url` is
+        deleted, so the next holder of the origin starts clean. keepalive()
+        renews the lease and reports progress; call it while harvesting.
+        Each of `seeds` is requested through ZAP first, so the spider
+        starts from every URL already known under `url`.
+        A spider that has not finished within `timeout` seconds is stopped
+        and RuntimeError is raised.
+        """
+        parsed = urlparse(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        with self.pool.lease(origin, on_wait=self._progress) as (daemon, renew):
+            def keepalive():
+                renew()
+                self._progress()
+
+            try:
+                # Drop anything a crashed earlier holder left under this root
+                self._delete_site_node(daemon, url)
+                self._include(daemon, origin)
+                for seed in seeds:
+                    try:
+                        daemon.get("/JSON/core/action/accessUrl/", url=seed, followRedirects="false")
+                    except Exception as e:
+                        print(f"[-] Error seeding {seed} into ZAP: {e}")
+                    keepalive()
+                response = daemon.get(
+                    "/JSON/spider/action/scan/",
+                    url=url, maxChildren=max_children, contextName=self.context_name,
+                    recurse="true", subtreeOnly="true",
+                )
+                scan_id = response.get("scan")
+                if not scan_id:
+                    raise RuntimeError(f"Failed to start ZAP Spider for {url}")
+
+                # Poll Spider Status until it's 100%
+                deadline = time.monotonic() + timeout
+                try:
+                    while daemon.get("/JSON/spider/view/status/", scanId=scan_id).get("status") != "100":
+                        if time.monotonic() > deadline:
+                            raise RuntimeError(f"ZAP Spider for {url} did not finish within {timeout}s")
+                        keepalive()
+                        time.sleep(ZAP_POLL_SECONDS)
+                finally:
+                    # Stopping a finished spider is a no-op; removing it frees ZAP's memory
+                    for action in ("stop", "removeScan"):
+                        try:
+                            daemon.get(f"/JSON/spider/action/{action}/", scanId=scan_id)
+                        except Exception as e:
+                            print(f"[-] Error on spider {action} for {url}: {e}")
+
+                yield daemon, keepalive
+            finally:
+                self._delete_site_node(daemon, url)
+
+    def close(self):
+        """
+        Remove this scan's context from every daemon it used.
+        """
+        for daemon, _ in self._origins.values():
+            try:
+                daemon.get("/JSON/context/action/removeContext/", contextName=self.context_name)
+            except Exception as e:
+                print(f"[-] Error removing context {self.context_name} on {daemon.base_url}: {e}")
+        self._origins = {}
@@ -1,40 +1,40 @@
-import requests
 import os
-from db import insert_alert
+import time
+from urllib.parse import urlparse
 
-ZAP_API_KEY = os.getenv("ZAP_API_KEY")
-ZAP_BASE_URL = os.getenv("ZAP_BASE_URL")
+from db import insert_alerts
+from zap_pool import ZapDaemon, ZAP_BASE_URLS, ZAP_POLL_SECONDS
 
-def start_passive_scan(target_url):
+# Alerts fetched from ZAP per request, and stored per transaction
+ZAP_ALERT_PAGE_SIZE = int(os.getenv("ZAP_ALERT_PAGE_SIZE", "500"))
+# How long to wait for ZAP's passive scanner to drain before giving up on a harvest
+ZAP_PSCAN_TIMEOUT_SECONDS = int(os.getenv("ZAP_PSCAN_TIMEOUT_SECONDS", "1800"))
+# A spider root's alerts are taken as complete once their count holds this long
+ZAP_PSCAN_SETTLE_SECONDS = int(os.getenv("ZAP_PSCAN_SETTLE_SECONDS", "60"))
+
+def _default_daemon():
+    return ZapDaemon(ZAP_BASE_URLS[0])
+
+def start_passive_scan(target_url, daemon=None):
     """
     Initiates a Passive Scan for a target URL using ZAP.
     """
+    daemon = daemon or _default_daemon()
     try:
         print(f"[+] Starting Passive Scan for {target_url}")
-        response = requests.get(
-            f"{ZAP_BASE_URL}/JSON/core/action/scan/",
-            params={"apikey": ZAP_API_KEY, "url": target_url},
-            timeout=10,
-        )
-        response.raise_for_status()
-        return response.json().get("scan")
+        return daemon.get("/JSON/core/action/scan/", url=target_url).get("scan")
     except Exception as e:
         print(f"[-] Error starting Passive Scan: {e}")
         return None
 
-def poll_passive_scan_status(scan_id):
+def poll_passive_scan_status(scan_id, daemon=None):
     """
     Polls the Passive Scan status until it is complete.
     """
+    daemon = daemon or _default_daemon()
     while True:
         try:
-            response = requests.get(
-                f"{ZAP_BASE_URL}/JSON/core/view/status/",
-                params={"apikey": ZAP_API_KEY, "scanId": scan_id},
-                timeout=10,
-            )
-            response.raise_for_status()
-            status = int(response.json().get("status", 0))
+            status = int(daemon.get("/JSON/core/view/status/", scanId=scan_id).get("status", 0))
             print(f"[+] Passive Scan progress: {status}%")
             if status >= 100:
                 break
@@ -42,20 +42,139 @@ def poll_passive_scan_status(scan_id):
             print(f"[-] Error polling Passive Scan status: {e}")
             break
 
-def get_alerts(endpoint_uid, target_url):
+def get_alerts(endpoint_uid, target_url, daemon=None):
     """
     Retrieves alerts for a target URL and stores them in the database.
+    `daemon` must be the ZAP daemon that scanned the URL, and the call must
+    happen inside that scan's ZapScanSession.spider block (see zap_pool.py).
     """
+    daemon = daemon or _default_daemon()
     try:
+        wait_for_passive_scan(daemon, target_url)
         print(f"[+] Fetching alerts for {target_url}")
-        response = requests.get(
-            f"{ZAP_BASE_URL}/JSON/core/view/alerts/",
-            params={"apikey": ZAP_API_KEY, "baseurl": target_url},
-            timeout=10,
-        )
-        response.raise_for_status()
-        alerts = response.json().get("alerts", [])
-        for alert in alerts:
-            insert_alert(endpoint_uid, alert)
+        for page in iter_alert_pages(daemon, target_url):
+            insert_alerts([(endpoint_uid, alert) for alert in page])
     except Exception as e:
         print(f"[-] Error retrieving alerts: {e}")
+
+def wait_for_passive_scan(daemon, baseurl=None, renew=None, timeout=ZAP_PSCAN_TIMEOUT_SECONDS):
+    """
+    Block until the alerts for what was just spidered exist, so they can be
+    harvested. ZAP's recordsToScan counts the whole daemon's backlog, which
+    other scans keep refilling under load, so when `baseurl` is given the
+    wait also ends once the number of alerts under it has not changed for
+    ZAP_PSCAN_SETTLE_SECONDS.
+    `renew` keeps the caller's lease alive while waiting.
+    Raises RuntimeError on timeout rather than harvesting a partial set.
+    """
+    deadline = time.monotonic() + timeout
+    alert_count = None
+    settled_at = time.monotonic() + ZAP_PSCAN_SETTLE_SECONDS
+    while True:
+        remaining = int(daemon.get("/JSON/pscan/view/recordsToScan/").get("recordsToScan", 0))
+        if remaining == 0:
+            return
+        if baseurl:
+            count = int(daemon.get("/JSON/alert/view/numberOfAlerts/", baseurl=baseurl).get("numberOfAlerts", 0))
+            if count != alert_count:
+                alert_count = count
+                settled_at = time.monotonic() + ZAP_PSCAN_SETTLE_SECONDS
+            elif time.monotonic() > settled_at:
+                return
+        if time.monotonic() > deadline:
+            raise RuntimeError(
+                f"ZAP passive scan on {daemon.base_url} still has {remaining} records after {timeout}s"
+            )
+        if renew:
+            renew()
+        time.sleep(ZAP_POLL_SECONDS)
+
+def iter_alert_pages(daemon, baseurl, page_size=ZAP_ALERT_PAGE_SIZE):
+    """
+    Yield the alerts under `baseurl` one page at a time, so only a single
+    page of ZAP's response is ever held in memory.
+    """
+    start = 0
+    while True:
+        page = daemon.get(
+            "/JSON/core/view/alerts/", baseurl=baseurl, start=start, count=page_size
+        ).get("alerts", [])
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        start += page_size
+
+def plan_spider_roots(endpoints, domain):
+    """
+    Group a scan's endpoints so ZAP spiders each origin once.
+    `endpoints` is a list of {"id": ..., "url": ...}. Only origins on
+    `domain` or its subdomains are planned; third-party hosts the crawl
+    linked to (CDNs, tag managers) are not spidered. Returns
+      [{"root": "https://host/common/prefix/", "endpoints": [...]}, ...]
+    where root is the origin plus the longest directory prefix shared
+    by every endpoint on that origin.
+    """
+    domain = domain.lower().rstrip(".")
+    by_origin = {}
+    for endpoint in endpoints:
+        parsed = urlparse(endpoint["url"])
+        if not parsed.scheme or not parsed.netloc:
+            continue
+        host = (parsed.hostname or "").rstrip(".")
+        if host != domain and not host.endswith("." + domain):
+            continue
+        by_origin.setdefault(f"{parsed.scheme}://{parsed.netloc}", []).append(endpoint)
+
+    plans = []
+    for origin, group in sorted(by_origin.items()):
+        # Directory segments of each path, e.g. "/a/b/c.js" -> ["a", "b"]
+        dirs = [urlparse(e["url"]).path.split("/")[1:-1] for e in group]
+        common = []
+        for segments in zip(*dirs):
+            if len(set(segments)) != 1:
+                break
+            common.append(segments[0])
+        root = origin + "/" + "".join(f"{segment}/" for segment in common)
+        plans.append({"root": root, "endpoints": group})
+    return plans
+
+def match_endpoint(alert_url, endpoint_ids, url_lengths):
+    """
+    Return the ID of the endpoint whose URL is the longest prefix of
+    `alert_url` ending on a path boundary, or None. `endpoint_ids` maps
+    URL -> ID and `url_lengths` is its distinct key lengths, longest first.
+    https://a.com/x/a matches https://a.com/x/a/b and https://a.com/x/a?q=1,
+    but not https://a.com/x/apple.
+    """
+    for length in url_lengths:
+        prefix = alert_url[:length]
+        endpoint_id = endpoint_ids.get(prefix)
+        if endpoint_id is None:
+            continue
+        if length == len(alert_url) or prefix.endswith("/") or alert_url[length] in "/?#":
+            return endpoint_id
+    return None
+
+def harvest_alerts(daemon, root, endpoints, renew=None):
+    """
+    Wait for the passive scanner to finish with a spider root, then page
+    through the alerts under it once, storing each page in one transaction.
+    Each alert goes to the endpoint it belongs to (see match_endpoint);
+    alerts on URLs that match no endpoint are skipped.
+    """
+    endpoint_ids = {e["url"]: e["id"] for e in endpoints}
+    url_lengths = sorted({len(u) for u in endpoint_ids}, reverse=True)
+
+    wait_for_passive_scan(daemon, root, renew)
+
+    print(f"[+] Fetching alerts for {root}")
+    for page in iter_alert_pages(daemon, root):
+        if renew:
+            renew()
+        rows = []
+        for alert in page:
+            endpoint_id = match_endpoint(alert.get("url", ""), endpoint_ids, url_lengths)
+            if endpoint_id is not None:
+                rows.append((endpoint_id, alert))
+        insert_alerts(rows)